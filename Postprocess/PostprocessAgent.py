@@ -1,7 +1,14 @@
+import copy
+import functools
 import re
 from typing import List, Dict, Tuple, Optional, Union
 from autogen import ConversableAgent, GroupChat, GroupChatManager
 
+try:
+    import re2 as _fast_re  # pip install google-re2，DFA 引擎，线性时间扫描
+except ImportError:  # 未安装时使用标准库 re
+    _fast_re = re
+
 
 # --- 1. 全局状态存储 (沿用之前的思路) ---
 
@@ -16,6 +23,10 @@ class PostProcessRegistry:
 
 post_registry = PostProcessRegistry()
 
+# 占位符统一为 [[...]] 形式，编译一次供标签校验复用
+# 使用否定字符类代替 .*?，匹配过程无需回溯
+_TAG_RE = _fast_re.compile(r"\[\[[^\]]+\]\]")
+
 
 # --- 2. 核心后处理逻辑函数 (供 Agent 调用) ---
 
@@ -23,9 +34,13 @@ def check_tags_consistency(original_masked: str, translated_text: str) -> Tuple[
     """
     检查标签一致性：从原文和译文中提取 [[...]]，对比是否完全一致
     """
-    pattern = r"\[\[.*?\]\]"
-    original_tags = set(re.findall(pattern, original_masked))
-    translated_tags = set(re.findall(pattern, translated_text))
+    # 多数段落不含占位符：两侧都没有 "[[" 时无需启动正则扫描
+    if "[[" not in original_masked and "[[" not in translated_text:
+        return True, "Tags are consistent."
+    original_tags = set(_TAG_RE.findall(original_masked))
+    translated_tags = set(_TAG_RE.findall(translated_text))
+    if original_tags == translated_tags:
+        return True, "Tags are consistent."
 
     missing = original_tags - translated_tags
     extra = translated_tags - original_tags
@@ -36,19 +51,90 @@ def check_tags_consistency(original_masked: str, translated_text: str) -> Tuple[
     return True, "Tags are consistent."
 
 
-def perform_final_reduction(text: str, mask_map: Dict[str, str]) -> str:
+def perform_final_reduction(text: str, originals: List[str]) -> str:
     """
     物理还原：将占位符替换回原始敏感数据
+    占位符为定宽的 [[M000012]]，用 str.find 定位 "[[" 后直接解析 6 位编号并按下标取原文
     """
-    final_text = text
-    for placeholder, original in mask_map.items():
-        final_text = final_text.replace(placeholder, original)
-    return final_text
+    if not originals or "[[" not in text:
+        return text
+
+    parts = []
+    pos = 0
+    find = text.find
+    count = len(originals)
+    while True:
+        start = find("[[", pos)
+        if start < 0:
+            break
+        digits = text[start + 3:start + 9]
+        if (text[start + 2:start + 3] == "M" and text[start + 9:start + 11] == "]]"
+                and digits.isascii() and digits.isdigit() and int(digits) < count):
+            parts.append(text[pos:start])
+            parts.append(originals[int(digits)])
+            pos = start + 11
+        else:
+            # 非占位符的 "[[" 原样保留，从下一个字符继续查找 (兼容 "[[[M000000]]" 等情况)
+            parts.append(text[pos:start + 1])
+            pos = start + 1
+    parts.append(text[pos:])
+    return "".join(parts)
 
 
 # --- 3. 代理定义 ---
 
+def _freeze(value):
+    """将嵌套的 dict / list 配置转换为可哈希的 tuple，首元素标记容器类型，避免 dict 与等形状的 list 冲突"""
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((k, _freeze(v)) for k, v in value.items())))
+    if isinstance(value, list):
+        return ("list", tuple(_freeze(v) for v in value))
+    if isinstance(value, tuple):
+        return ("tuple", tuple(_freeze(v) for v in value))
+    return value
+
+
+class _ConfigKey:
+    """config_list 的可哈希包装，作为代理缓存的键"""
+
+    def __init__(self, config_list: List[Dict]):
+        # 含不可深拷贝 / 不可哈希的值 (如 http_client 对象) 时在此抛出 TypeError / copy.Error
+        self.config_list = copy.deepcopy(config_list)
+        self._key = _freeze(config_list)
+        self._hash = hash(self._key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return isinstance(other, _ConfigKey) and self._key == other._key
+
+
 def setup_post_processing_agents(config_list: List[Dict]):
+    """
+    相同 config_list 复用已构建的代理，避免每次工作流都重新创建 LLM 客户端
+    返回前清空代理的对话历史，各文档之间互不影响
+    注意：缓存的代理为进程内共享、单用户使用，同一时刻只能进行一个对话 (再次调用会清空进行中的对话)；
+    需要并发对话时请为每个对话调用 create_post_processing_agents 新建代理
+    """
+    try:
+        key = _ConfigKey(config_list)
+    except (TypeError, copy.Error):
+        # 配置无法作为缓存键时退化为每次新建
+        return create_post_processing_agents(config_list)
+
+    agents = _cached_post_processing_agents(key)
+    for agent in agents:
+        agent.reset()
+    return agents
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_post_processing_agents(config: _ConfigKey):
+    return create_post_processing_agents(config.config_list)
+
+
+def create_post_processing_agents(config_list: List[Dict]):
     # 3.1 质量检查员 (Inspector)
     inspector_agent = ConversableAgent(
         name="Inspector_Agent",
@@ -155,8 +241,8 @@ if __name__ == "__main__":
         print("   [决策: 打回] 重新触发 Translation_Agent 进行修复。")
 
     print("\n2. Reid_Agent 最终还原测试...")
-    mock_mask_map = {"[[EMAIL_123]]": "support@autogen.ai"}
-    mock_translated = "请联系 [[EMAIL_123]] 获取支持。"
-    final = perform_final_reduction(mock_translated, mock_mask_map)
+    mock_originals = ["support@autogen.ai"]
+    mock_translated = "请联系 [[M000000]] 获取支持。"
+    final = perform_final_reduction(mock_translated, mock_originals)
     print(f"   [原始译文]: {mock_translated}")
     print(f"   [还原结果]: {final}")
\ No newline at end of file
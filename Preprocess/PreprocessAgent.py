@@ -1,46 +1,86 @@
+import functools
 import re
-import uuid
-from typing import List, Dict, Union, Optional, Tuple
+from typing import Iterator, List, Dict, Union, Optional, Tuple
 from autogen import ConversableAgent
 
+try:
+    import re2 as _fast_re  # pip install google-re2，DFA 引擎，线性时间扫描
+except ImportError:  # 未安装时使用标准库 re
+    _fast_re = re
+
 
 # --- 1. 核心业务逻辑 (保持不变) ---
 
 class TranslationRegistry:
     def __init__(self):
-        self.mask_map: Dict[str, str] = {}
+        # 脱敏映射按列存储：占位符 [[M000012]] 中的编号即两个列表的下标
+        self.labels: List[str] = []
+        self.originals: List[str] = []
+        # 原文 -> 编号：同一敏感信息重复出现时复用占位符，重复段落脱敏后仍然相同，可被去重
+        self.index: Dict[str, int] = {}
         self.segments: List[str] = []
 
     def reset(self):
-        self.mask_map.clear()
+        self.labels.clear()
+        self.originals.clear()
+        self.index.clear()
         self.segments.clear()
 
 
 registry = TranslationRegistry()
 
+# 占位符为定宽 ASCII：[[M + 6 位十进制编号 + ]]
+PLACEHOLDER_DIGITS = 6
+MAX_PLACEHOLDERS = 10 ** PLACEHOLDER_DIGITS
+
+
+def make_placeholder(idx: int) -> str:
+    return f"[[M{idx:06d}]]"
+
+
+# 各类敏感信息合并为一个带命名分组的正则，单次扫描完成脱敏
+# 固定使用标准库 re：RE2 的 \s / \d / \b 只识别 ASCII，URL 会吞掉其后的全角空格 (U+3000)、
+# 不换行空格 (U+00A0) 及后续中文，且不接受 re 的 flags，无法对齐语义
+# 原文中已有的占位符形状文本 (如字面量 [[M000001]]) 也作为一类脱敏条目，换成新编号并原样还原，
+# 避免被还原阶段误当作占位符替换成其他敏感信息
+_MASK_RE = re.compile(
+    r'(?P<LITERAL>\[\[M[0-9]{6}\]\])'
+    r'|(?P<EMAIL>[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9.-]+)'
+    r'|(?P<IP>\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b)'
+    r'|(?P<URL>https?://[^\s]+)'
+)
+# 每个句子 = 若干非句末字符 + 一个句末标点；末尾无标点的残句单独成句
+# 只含字面字符，RE2 与标准库 re 语义一致
+_SENT_RE = _fast_re.compile(r'[^。！？\.!\?]*[。！？\.!\?]|[^。！？\.!\?]+')
 
-def local_masking_logic(text: str) -> str:
-    patterns = {
-        "EMAIL": r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+',
-        "IP": r'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b',
-        "URL": r'https?://[^\s]+'
-    }
-    processed_text = text
-    for label, pattern in patterns.items():
-        def replace(match):
-            original = match.group(0)
-            placeholder = f"[[{label}_{uuid.uuid4().hex[:4].upper()}]]"
-            registry.mask_map[placeholder] = original
-            return placeholder
 
-        processed_text = re.sub(pattern, replace, processed_text)
-    return processed_text
+def _mask_replace(reg: TranslationRegistry, match: re.Match) -> str:
+    original = match.group(0)
+    idx = reg.index.get(original)
+    if idx is None:
+        idx = len(reg.originals)
+        if idx >= MAX_PLACEHOLDERS:
+            raise ValueError(f"单个文档的脱敏条目超过上限 {MAX_PLACEHOLDERS}")
+        # lastgroup 即命中的分组名 (LITERAL / EMAIL / IP / URL)
+        reg.labels.append(match.lastgroup)
+        reg.originals.append(original)
+        reg.index[original] = idx
+    return make_placeholder(idx)
 
 
-def local_splitting_logic(text: str) -> List[str]:
-    sentence_delimiters = r'(?<=[。！？\.!\?])\s*'
-    sentences = re.split(sentence_delimiters, text)
-    return [s.strip() for s in sentences if s.strip()]
+def local_masking_logic(text: str, reg: Optional[TranslationRegistry] = None) -> str:
+    # 默认写入模块级 registry；并发处理多个文档时每个文档传入独立的 TranslationRegistry
+    if reg is None:
+        reg = registry
+    return _MASK_RE.sub(functools.partial(_mask_replace, reg), text)
+
+
+def local_splitting_logic(text: str) -> Iterator[str]:
+    # 惰性产出分句结果，不构造中间列表
+    for match in _SENT_RE.finditer(text):
+        sentence = match.group(0).strip()
+        if sentence:
+            yield sentence
 
 
 # --- 2. 修正后的 AutoGen 回复逻辑 ---
@@ -64,13 +104,12 @@ def preprocessor_reply_func(
     registry.reset()
     # 执行处理
     masked_text = local_masking_logic(last_msg)
-    registry.segments = local_splitting_logic(masked_text)
+    registry.segments = list(local_splitting_logic(masked_text))
 
     # 构造输出
-    output = "--- 预处理完成 ---\n"
-    output += f"分段数量: {len(registry.segments)}\n"
-    for i, s in enumerate(registry.segments):
-        output += f"段落 {i + 1}: {s}\n"
+    parts = ["--- 预处理完成 ---\n", f"分段数量: {len(registry.segments)}\n"]
+    parts.extend(f"段落 {i + 1}: {s}\n" for i, s in enumerate(registry.segments))
+    output = "".join(parts)
 
     # 返回 True 表示该代理已处理完毕，不需要再调用其他回复钩子或 LLM
     return True, output
@@ -79,6 +118,16 @@ def preprocessor_reply_func(
 # --- 3. 代理设置 ---
 
 def setup_local_workflow():
+    # 代理只依赖固定配置，进程内只构建一次；返回前清空对话历史，各文档之间互不影响
+    # 缓存的代理为单用户使用 (预处理结果也写入模块级 registry)，同一时刻只能进行一个对话
+    agents = _cached_local_workflow()
+    for agent in agents:
+        agent.reset()
+    return agents
+
+
+@functools.lru_cache(maxsize=1)
+def _cached_local_workflow():
     # 执行者：Regex_Preprocessor
     executor_agent = ConversableAgent(
         name="Regex_Preprocessor",
@@ -124,5 +173,5 @@ if __name__ == "__main__":
     )
 
     print("\n>>> 最终提取的脱敏映射表 (Registry):")
-    for placeholder, original in registry.mask_map.items():
-        print(f"{placeholder} => {original}")
\ No newline at end of file
+    for idx, (label, original) in enumerate(zip(registry.labels, registry.originals)):
+        print(f"{make_placeholder(idx)} => {original} ({label})")
\ No newline at end of file
@@ -1,7 +1,18 @@
+import functools
+import heapq
+import math
 import re
+from collections import defaultdict
 from typing import List, Dict, Union, Optional, Tuple, Annotated
 from autogen import ConversableAgent
 
+try:
+    import ahocorasick  # pip install pyahocorasick
+except ImportError:  # 未安装时退化为逐词扫描
+    ahocorasick = None
+
+_TOKEN_RE = re.compile(r"\w+")
+
 
 # --- 1. 模拟底层检索驱动 (生产环境需替换为 ES/Milvus 客户端) ---
 
@@ -18,22 +29,118 @@ class MockStorage:
             {"src": "The workflow is highly deterministic.", "tgt": "该工作流具有高度确定性。"},
             {"src": "Using AutoGen for complex tasks.", "tgt": "使用 AutoGen 处理复杂任务。"}
         ]
+        self.reload_index()
+
+    def reload_index(self):
+        """术语表或 TM 变更后调用：重建索引并清空检索缓存"""
+        # 术语表构建为 Aho-Corasick 自动机，一次线性扫描即可命中全部术语
+        self._term_automaton = self._build_term_automaton()
+        # TM 建立 BM25 倒排索引，检索时只访问命中词的倒排链
+        self._build_tm_index()
+        # 同一段落在重试与跨文档时反复出现，按实例缓存检索结果；缓存内为不可变 tuple
+        self._term_cache = functools.lru_cache(maxsize=10000)(self._exact_term_match)
+        self._tm_cache = functools.lru_cache(maxsize=10000)(self._hybrid_tm_match)
+
+    def _build_term_automaton(self):
+        if ahocorasick is None or not self.glossary:
+            return None
+        # 仅大小写不同的术语 (如 "AutoGen" 与 "autogen") 小写后相同，需挂在同一个键下全部保留
+        entries: Dict[str, List[Tuple[int, str, str]]] = defaultdict(list)
+        for order, (k, v) in enumerate(self.glossary.items()):
+            entries[k.lower()].append((order, k, v))
+        automaton = ahocorasick.Automaton()
+        for key, value in entries.items():
+            automaton.add_word(key, tuple(value))
+        automaton.make_automaton()
+        return automaton
 
     def exact_term_match(self, text: str) -> List[Dict]:
-        found = []
-        for k, v in self.glossary.items():
-            if k.lower() in text.lower():
-                found.append({"term": k, "translation": v})
-        return found
-
-    def hybrid_tm_match(self, text: str) -> List[Dict]:
-        # 此处应为：关键词检索(BM25) + 向量检索(Vector) 的融合结果
-        # 暂时用简单逻辑模拟
-        results = []
-        for entry in self.tm_data:
-            if any(word.lower() in entry["src"].lower() for word in text.split() if len(word) > 3):
-                results.append(entry)
-        return results
+        # 返回副本，调用方修改结果不会污染缓存
+        return [dict(m) for m in self._term_cache(text)]
+
+    def _exact_term_match(self, text: str) -> Tuple[Dict, ...]:
+        text_lower = text.lower()
+        if self._term_automaton is None:
+            return tuple({"term": k, "translation": v} for k, v in self.glossary.items() if k.lower() in text_lower)
+
+        hits = {}
+        for _, matched in self._term_automaton.iter(text_lower):
+            for order, k, v in matched:
+                hits[order] = {"term": k, "translation": v}
+        # 按术语表顺序输出，与逐词扫描的结果保持一致
+        return tuple(hits[order] for order in sorted(hits))
+
+    def _build_tm_index(self):
+        # 词表：token -> 整数 id，倒排链与 idf 均按 id 存放在列表中
+        self._tm_vocab: Dict[str, int] = {}
+        self._tm_postings: List[List[Tuple[int, int]]] = []
+        # 预筛用：原文字符长度与字符二元组集合
+        self._tm_char_len: List[int] = []
+        self._tm_bigrams: List[frozenset] = []
+        doc_len: List[int] = []
+        for idx, entry in enumerate(self.tm_data):
+            src = entry["src"].lower()
+            self._tm_char_len.append(len(src))
+            self._tm_bigrams.append(frozenset(zip(src, src[1:])))
+            tokens = _TOKEN_RE.findall(src)
+            doc_len.append(len(tokens))
+            tf = defaultdict(int)
+            for tok in tokens:
+                tf[self._tm_vocab.setdefault(tok, len(self._tm_vocab))] += 1
+            for tok_id, count in tf.items():
+                if tok_id == len(self._tm_postings):
+                    self._tm_postings.append([])
+                self._tm_postings[tok_id].append((idx, count))
+
+        # 与查询无关的量在建索引时一次算好：每个词的 idf、每条 TM 的 dl/avgdl
+        n_docs = len(self.tm_data)
+        self._tm_idf: List[float] = [
+            math.log((n_docs - len(postings) + 0.5) / (len(postings) + 0.5) + 1) for postings in self._tm_postings
+        ]
+        avgdl = sum(doc_len) / n_docs if n_docs else 0.0
+        self._tm_len_ratio: List[float] = [dl / avgdl if avgdl else 0.0 for dl in doc_len]
+
+    def _tm_prefilter(self, idx: int, query_len: int, query_bigrams: frozenset, min_jaccard: float) -> bool:
+        """廉价预筛：长度相差两倍以上且字符二元组 Jaccard 低于阈值的条目直接跳过"""
+        entry_len = self._tm_char_len[idx]
+        if entry_len <= 2 * query_len and query_len <= 2 * entry_len:
+            return True
+        entry_bigrams = self._tm_bigrams[idx]
+        # |A ∪ B| = |A| + |B| - |A ∩ B|，只需构造一次交集
+        inter = len(query_bigrams & entry_bigrams)
+        union = len(query_bigrams) + len(entry_bigrams) - inter
+        return union > 0 and inter / union >= min_jaccard
+
+    def hybrid_tm_match(self, text: str, top_k: int = 5, k1: float = 1.5, b: float = 0.75,
+                        min_jaccard: float = 0.1) -> List[Dict]:
+        # 返回副本，调用方修改结果不会污染缓存或 tm_data
+        return [dict(m) for m in self._tm_cache(text, top_k, k1, b, min_jaccard)]
+
+    def _hybrid_tm_match(self, text: str, top_k: int, k1: float, b: float, min_jaccard: float) -> Tuple[Dict, ...]:
+        # 关键词检索(BM25)；向量检索(Vector) 待接入 embedding 模型后在此融合
+        text = text.lower()
+        query_ids = {self._tm_vocab.get(w) for w in _TOKEN_RE.findall(text) if len(w) > 3}
+        query_ids.discard(None)
+        if not query_ids:
+            return ()
+
+        query_bigrams = frozenset(zip(text, text[1:]))
+        scores: Dict[int, float] = defaultdict(float)
+        passed: Dict[int, bool] = {}
+        for tok_id in query_ids:
+            idf = self._tm_idf[tok_id]
+            for idx, tf in self._tm_postings[tok_id]:
+                ok = passed.get(idx)
+                if ok is None:
+                    ok = passed[idx] = self._tm_prefilter(idx, len(text), query_bigrams, min_jaccard)
+                if not ok:
+                    continue
+                norm = k1 * (1 - b + b * self._tm_len_ratio[idx])
+                scores[idx] += idf * tf * (k1 + 1) / (tf + norm)
+
+        # 同分时按 TM 原始顺序，保证结果确定
+        top = heapq.nlargest(top_k, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+        return tuple(self.tm_data[idx] for idx, _ in top)
 
 
 storage = MockStorage()
@@ -55,14 +162,13 @@ def terminology_reply_func(
     # 这里演示针对单段文本的处理
     matches = storage.exact_term_match(last_msg)
 
-    response = "--- Terminology Results ---\n"
+    parts = ["--- Terminology Results ---\n"]
     if matches:
-        for m in matches:
-            response += f"Found Term: {m['term']} -> {m['translation']}\n"
+        parts.extend(f"Found Term: {m['term']} -> {m['translation']}\n" for m in matches)
     else:
-        response += "No matching terms found."
+        parts.append("No matching terms found.")
 
-    return True, response
+    return True, "".join(parts)
 
 
 # --- 3. 翻译记忆 Agent 逻辑 (MemoryRetrieverAgent) ---
@@ -79,14 +185,13 @@ def memory_reply_func(
     last_msg = messages[-1].get("content", "")
     matches = storage.hybrid_tm_match(last_msg)
 
-    response = "--- Translation Memory Results ---\n"
+    parts = ["--- Translation Memory Results ---\n"]
     if matches:
-        for m in matches:
-            response += f"Matched TM: {m['src']} | {m['tgt']}\n"
+        parts.extend(f"Matched TM: {m['src']} | {m['tgt']}\n" for m in matches)
     else:
-        response += "No similar translation memory found."
+        parts.append("No similar translation memory found.")
 
-    return True, response
+    return True, "".join(parts)
 
 
 # --- 4. 构建代理架构 ---
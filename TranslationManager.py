@@ -1,12 +1,43 @@
+import asyncio
+import logging
+import logging.handlers
+import sys
 import time
 import uuid
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 # 导入之前定义的模块组件 (假设已在同目录下)
 # 如果是真实运行，请确保这些类和函数在你的 python path 中
-from Preprocess.PreprocessAgent import registry as pre_reg, local_masking_logic, local_splitting_logic
+from Preprocess.PreprocessAgent import TranslationRegistry, local_masking_logic, local_splitting_logic
 from Retriever.RetrieveAgent import storage as retrieval_db
 from Postprocess.PostprocessAgent import check_tags_consistency, perform_final_reduction
 
+# 工作流日志：先缓存在 MemoryHandler 中，每个工作流结束 (含异常退出) 时统一输出到 stdout
+# 默认 INFO 级别只输出阶段与状态 (失败环节以 WARNING 级别附带原因)，DEBUG 级别才格式化输出全部明细
+class _StdoutHandler(logging.StreamHandler):
+    """每次输出时取当前的 sys.stdout，与 print 共用同一缓冲区，兼容 redirect_stdout 与 pytest 捕获"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+logger = logging.getLogger("workflow")
+if not logger.handlers:
+    _stdout_handler = _StdoutHandler()
+    _stdout_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(logging.handlers.MemoryHandler(capacity=1000, target=_stdout_handler))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def flush_logs():
+    for handler in logger.handlers:
+        handler.flush()
+
 
 class TranslationWorkflowManager:
     """
@@ -14,90 +45,169 @@ class TranslationWorkflowManager:
     功能：编排各代理任务，监控执行进度，处理打回重译逻辑
     """
 
-    def __init__(self, config_list: List[Dict]):
+    def __init__(self, config_list: List[Dict], max_concurrency: int = 8):
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency 必须 >= 1，当前为 {max_concurrency}")
         self.config_list = config_list
+        # 同时在途的段落数上限，避免触发 LLM 接口限流
+        self.max_concurrency = max_concurrency
         self.workflow_id = str(uuid.uuid4())[:8]
-        print(f"=== [Workflow Initialized] ID: {self.workflow_id} ===")
-
-    def log_step(self, step_name: str, status: str, details: Any = None):
-        """格式化输出每个环节的执行结果"""
-        print(f"\n>>阶段: {step_name}")
-        print(f"  状态: {status}")
-        if details:
+        logger.info("=== [Workflow Initialized] ID: %s ===", self.workflow_id)
+        flush_logs()
+
+    def log_step(self, step_name: str, status: str, details: Any = None, level: int = logging.INFO):
+        """
+        格式化输出每个环节的执行结果 (每个环节一条日志记录)
+        失败环节传入 level=logging.WARNING，明细 (如失败原因) 始终输出；常规环节的明细仅在 DEBUG 级别输出
+        """
+        is_failure = level >= logging.WARNING
+        if details and (is_failure or logger.isEnabledFor(logging.DEBUG)):
             if isinstance(details, list):
-                for i, item in enumerate(details):
-                    print(f"  - [{i}]: {item}")
+                detail_text = "\n".join(f"  - [{i}]: {item}" for i, item in enumerate(details))
             else:
-                print(f"  明细: {details}")
-        print("-" * 50)
-
-    def execute_workflow(self, raw_text: str):
+                detail_text = f"  明细: {details}"
+            logger.log(level if is_failure else logging.DEBUG,
+                       "\n>>阶段: %s\n  状态: %s\n%s\n%s", step_name, status, detail_text, "-" * 50)
+        else:
+            logger.log(level, "\n>>阶段: %s\n  状态: %s\n%s", step_name, status, "-" * 50)
+
+    def _retrieve(self, idx: int, segment: str) -> Tuple[List[Dict], List[Dict]]:
+        """步骤 2: 术语与记忆检索 (CPU 密集，在线程池中执行)"""
+        terms = retrieval_db.exact_term_match(segment)
+        tm_refs = retrieval_db.hybrid_tm_match(segment)
+        self.log_step(f"2.{idx + 1} 知识检索", "完成", {
+            "匹配术语": [f"{t['term']}->{t['translation']}" for t in terms],
+            "匹配 TM": [f"{m['src']}" for m in tm_refs]
+        })
+        return terms, tm_refs
+
+    async def _translate(self, idx: int, segment: str, terms: List[Dict], tm_refs: List[Dict]) -> str:
+        """步骤 3 ~ 4: 翻译与标签校验重译 (I/O 密集，等待 LLM 期间让出事件循环)"""
+        # 3.1 核心翻译 (此处模拟调用，后期对接真实 Agent)
+        # 实际代码中这里应 await translation_engine.agent.a_generate_reply(...)
+        # 流水线按段调用而非 TranslationEngine.translate_batch：标签校验与重译以段为单位，
+        # 逐段流转时润色与还原可尽早开始，单段失败也不会拖累同批其他段落；
+        # 批量接口面向离线整篇翻译 (见 Translator.TranslateAgent.run_translation_phase)
+        translated_text = f"这是对 '{segment}' 的模拟翻译结果。"  # 模拟输出
+        self.log_step(f"3.{idx + 1} 机器翻译", "完成", translated_text)
+
+        # --- 步骤 4: 后处理检查 (Post-processing & Feedback Loop) ---
+        retry_count = 0
+        max_retries = 2
+        is_valid = False
+
+        current_translation = translated_text
+
+        while not is_valid and retry_count <= max_retries:
+            # 4.1 标签一致性检查 (硬约束)
+            is_tag_ok, tag_msg = check_tags_consistency(segment, current_translation)
+            if not is_tag_ok:
+                retry_count += 1
+                self.log_step(f"4.{idx + 1}.{retry_count} 标签校验", "失败", f"原因: {tag_msg} -> 触发重译",
+                              level=logging.WARNING)
+                # 模拟修复后的翻译
+                current_translation = f"修复标签后的翻译: {segment}"
+                continue
+
+            self.log_step(f"4.{idx + 1} 标签校验", "通过")
+
+            # 4.2 质量检查 (QE/Inspector) 模拟
+            # 这里可以接入 LLM QE Agent
+            is_valid = True
+
+        return current_translation
+
+    def _finalize(self, idx: int, translation: str, originals: List[str]) -> str:
+        """步骤 5 ~ 6: 润色与还原 (CPU 密集，在线程池中执行)"""
+        # --- 步骤 5: 润色 (Polishing) ---
+        polished_text = f"润色后的: {translation}"  # 模拟润色
+        self.log_step(f"5.{idx + 1} 文本润色", "完成", polished_text)
+
+        # --- 步骤 6: 还原 (Re-identification) ---
+        final_output = perform_final_reduction(polished_text, originals)
+        self.log_step(f"6.{idx + 1} 最终还原", "完成", final_output)
+        return final_output
+
+    async def execute_workflow(self, raw_text: str):
+        try:
+            return await self._run_workflow(raw_text)
+        finally:
+            # 成功或异常都输出已缓存的日志
+            flush_logs()
+
+    async def _run_workflow(self, raw_text: str):
         start_time = time.time()
 
         # --- 步骤 1: 预处理 (Preprocessing) ---
-        pre_reg.reset()
-        masked_text = local_masking_logic(raw_text)
-        pre_reg.segments = local_splitting_logic(masked_text)
+        # 脱敏映射与分句结果均为本次运行私有，同一进程内并发执行多个工作流互不干扰
+        doc_registry = TranslationRegistry()
+        masked_text = local_masking_logic(raw_text, doc_registry)
+        originals = doc_registry.originals
+        segments: List[str] = []
 
         self.log_step("1. 预处理 (Preprocessing)", "完成", {
-            "分段数量": len(pre_reg.segments),
-            "脱敏映射数": len(pre_reg.mask_map),
+            "脱敏映射数": len(originals),
             "脱敏预览": masked_text[:100] + "..."
         })
 
-        # --- 步骤 2 & 3: 检索与翻译 (Retrieval & Translation) ---
-        final_results = []
-
-        for idx, segment in enumerate(pre_reg.segments):
-            print(f"\n[正在处理第 {idx + 1}/{len(pre_reg.segments)} 段]")
-
-            # 2.1 术语与记忆检索
-            terms = retrieval_db.exact_term_match(segment)
-            tm_refs = retrieval_db.hybrid_tm_match(segment)
-            self.log_step(f"2.{idx + 1} 知识检索", "完成", {
-                "匹配术语": [f"{t['term']}->{t['translation']}" for t in terms],
-                "匹配 TM": [f"{m['src']}" for m in tm_refs]
-            })
-
-            # 3.1 核心翻译 (此处模拟调用，后期对接真实 Agent)
-            # 实际代码中这里应调用 translation_engine.py 里的逻辑
-            translated_text = f"这是对 '{segment}' 的模拟翻译结果。"  # 模拟输出
-            self.log_step(f"3.{idx + 1} 机器翻译", "完成", translated_text)
-
-            # --- 步骤 4: 后处理检查 (Post-processing & Feedback Loop) ---
-            retry_count = 0
-            max_retries = 2
-            is_valid = False
-
-            current_translation = translated_text
-
-            while not is_valid and retry_count <= max_retries:
-                # 4.1 标签一致性检查 (硬约束)
-                is_tag_ok, tag_msg = check_tags_consistency(segment, current_translation)
-                if not is_tag_ok:
-                    retry_count += 1
-                    self.log_step(f"4.{idx + 1}.{retry_count} 标签校验", "失败", f"原因: {tag_msg} -> 触发重译")
-                    # 模拟修复后的翻译
-                    current_translation = f"修复标签后的翻译: {segment}"
+        # --- 步骤 2 ~ 6: 三级流水线 ---
+        # 检索 -> q_retrieved -> 翻译 (max_concurrency 个并发 worker) -> q_translated -> 润色与还原
+        # 各级同时运行，检索与还原的耗时被 LLM 等待时间掩盖
+        loop = asyncio.get_running_loop()
+        q_retrieved: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency)
+        q_translated: asyncio.Queue = asyncio.Queue()
+        results: Dict[str, str] = {}
+
+        async def retrieve_stage():
+            # 分句结果惰性产出；重复段落 (版权声明、页眉等) 只处理一次，结果按原位置回填
+            seen = set()
+            for idx, segment in enumerate(local_splitting_logic(masked_text)):
+                segments.append(segment)
+                if segment in seen:
                     continue
-
-                self.log_step(f"4.{idx + 1} 标签校验", "通过")
-
-                # 4.2 质量检查 (QE/Inspector) 模拟
-                # 这里可以接入 LLM QE Agent
-                is_valid = True
-
-                # --- 步骤 5: 润色 (Polishing) ---
-            polished_text = f"润色后的: {current_translation}"  # 模拟润色
-            self.log_step(f"5.{idx + 1} 文本润色", "完成", polished_text)
-
-            # --- 步骤 6: 还原 (Re-identification) ---
-            final_output = perform_final_reduction(polished_text, pre_reg.mask_map)
-            final_results.append(final_output)
-            self.log_step(f"6.{idx + 1} 最终还原", "完成", final_output)
+                seen.add(segment)
+                logger.info("\n[正在处理第 %d 段]", idx + 1)
+                terms, tm_refs = await loop.run_in_executor(None, self._retrieve, idx, segment)
+                await q_retrieved.put((idx, segment, terms, tm_refs))
+            for _ in range(self.max_concurrency):
+                await q_retrieved.put(None)
+
+        async def translate_worker():
+            while (item := await q_retrieved.get()) is not None:
+                idx, segment, terms, tm_refs = item
+                translation = await self._translate(idx, segment, terms, tm_refs)
+                await q_translated.put((idx, segment, translation))
+
+        async def translate_stage(workers: List[asyncio.Task]):
+            await asyncio.gather(*workers)
+            await q_translated.put(None)
+
+        async def finalize_stage():
+            while (item := await q_translated.get()) is not None:
+                idx, segment, translation = item
+                results[segment] = await loop.run_in_executor(None, self._finalize, idx, translation, originals)
+
+        # 翻译 worker 显式创建为任务，与各阶段一起登记，异常时统一取消
+        workers = [asyncio.create_task(translate_worker()) for _ in range(self.max_concurrency)]
+        stages = [
+            asyncio.create_task(retrieve_stage()),
+            asyncio.create_task(translate_stage(workers)),
+            asyncio.create_task(finalize_stage()),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            # 任一阶段或 worker 异常时取消其余任务并等待其退出，避免其永久阻塞在队列上
+            pending = stages + workers
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        final_results = [results[segment] for segment in segments]
 
         end_time = time.time()
-        print(f"\n=== [Workflow Complete] 总耗时: {end_time - start_time:.2f}s ===")
+        logger.info("\n=== [Workflow Complete] 段落数: %d (去重后 %d) 总耗时: %.2fs ===",
+                    len(segments), len(results), end_time - start_time)
         return "\n".join(final_results)
 
 
@@ -106,6 +216,8 @@ class TranslationWorkflowManager:
 if __name__ == "__main__":
     # 配置信息（预留）
     config = [{"model": "gpt-4", "api_key": "YOUR_KEY"}]
+    # 演示时输出各阶段明细
+    logger.setLevel(logging.DEBUG)
 
     manager = TranslationWorkflowManager(config)
 
@@ -114,7 +226,7 @@ if __name__ == "__main__":
         "The workflow is highly deterministic."
     )
 
-    final_article = manager.execute_workflow(source_text)
+    final_article = asyncio.run(manager.execute_workflow(source_text))
 
     print("\n" + "=" * 20 + " 最终输出全文 " + "=" * 20)
     print(final_article)
\ No newline at end of file
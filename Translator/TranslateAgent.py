@@ -1,6 +1,9 @@
+import hashlib
 import json
+import re
+from collections import OrderedDict
 from typing import List, Dict, Optional, Tuple
-from autogen import ConversableAgent
+from autogen import Cache, ConversableAgent
 
 # --- 1. 翻译指令模板设计 ---
 
@@ -9,7 +12,7 @@ Your goal is to translate the given segment from English to Chinese.
 
 ### CRITICAL RULES:
 1. **Consistency**: Use the provided 'Terminology' for specific words.
-2. **Tags/Placeholders**: Keep all placeholders like [[MASK_VAR_XXXX]] or [[EMAIL_XXXX]] EXACTLY as they are. DO NOT translate or modify them.
+2. **Tags/Placeholders**: Keep all placeholders like [[M000001]] EXACTLY as they are. DO NOT translate or modify them.
 3. **Style**: Follow the style of the 'Translation Memory' if provided.
 4. **Output**: Return ONLY the translated text. No explanations, no notes.
 
@@ -18,11 +21,14 @@ Your goal is to translate the given segment from English to Chinese.
 - Maintain a formal and technical tone.
 """
 
+# 批量翻译时每段以 <n>...</n> 包裹，模型按相同编号返回
+_BATCH_RE = re.compile(r"<(\d+)>(.*?)</\1>", re.S)
+
 
 # --- 2. 翻译代理类实现 ---
 
 class TranslationEngine:
-    def __init__(self, llm_config: Dict):
+    def __init__(self, llm_config: Dict, cache_path: Optional[str] = None):
         # 强制覆盖确定性参数
         deterministic_config = llm_config.copy()
         deterministic_config.update({
@@ -37,34 +43,121 @@ class TranslationEngine:
             llm_config=deterministic_config,
             human_input_mode="NEVER",
         )
+        # 可选的跨进程持久化 LLM 响应缓存 (SQLite/diskcache)，传入 cache_path 时开启，重跑时相同请求直接命中磁盘
+        # 开启后需调用 close() 或使用 with 语句释放
+        # 缓存键由请求内容 (messages 等) 计算，段落或参考信息变化即自动失效
+        self.llm_cache = None
+        if cache_path:
+            self.llm_cache = Cache.disk(cache_seed=deterministic_config["cache_seed"], cache_path_root=cache_path)
+            self.agent.client_cache = self.llm_cache
+        # 进程内译文缓存：Prompt 内容摘要 -> 译文，相同段落与参考信息直接命中
+        self._reply_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self.cache_size = 10000
+
+    @staticmethod
+    def _append_references(parts: List[str], terms: List[Dict], tm: List[Dict]):
+        """术语与翻译记忆参考块，单段与批量 Prompt 共用"""
+        if terms:
+            parts.append("### Terminology Reference (MUST USE):\n")
+            parts.extend(f"- {t['term']} -> {t['translation']}\n" for t in terms)
+            parts.append("\n")
+
+        if tm:
+            parts.append("### Translation Memory (Style Reference):\n")
+            parts.extend(f"Source: {entry['src']}\nTarget: {entry['tgt']}\n" for entry in tm)
+            parts.append("\n")
 
     def construct_prompt(self, segment: str, terms: List[Dict], tm: List[Dict]) -> str:
         """
         组装最终发送给大模型的 Prompt
         """
-        prompt = f"Target Segment: {segment}\n\n"
+        parts = [f"Target Segment: {segment}\n\n"]
+        self._append_references(parts, terms, tm)
+        parts.append("Translated Chinese Text:")
+        return "".join(parts)
 
-        if terms:
-            prompt += "### Terminology Reference (MUST USE):\n"
-            for t in terms:
-                prompt += f"- {t['term']} -> {t['translation']}\n"
-            prompt += "\n"
+    def construct_batch_prompt(self, segments: List[str], terms: List[Dict], tm: List[Dict]) -> str:
+        """
+        将多个段落合并为一个 Prompt，一次请求分摊系统提示与参考信息的开销
+        """
+        parts = ["Target Segments (translate each one separately):\n"]
+        parts.extend(f"<{i}>{segment}</{i}>\n" for i, segment in enumerate(segments, 1))
+        parts.append("\n")
+        self._append_references(parts, terms, tm)
+        parts.append("Return every Chinese translation wrapped in the same numbered tags, e.g. <1>...</1>:")
+        return "".join(parts)
+
+    @staticmethod
+    def parse_batch_reply(reply: str, count: int) -> Optional[List[str]]:
+        """
+        解析批量译文；编号缺失或数量不符时返回 None，由调用方回退为逐段翻译
+        """
+        found = {int(num): text.strip() for num, text in _BATCH_RE.findall(reply or "")}
+        if sorted(found) != list(range(1, count + 1)):
+            return None
+        return [found[i] for i in range(1, count + 1)]
 
-        if tm:
-            prompt += "### Translation Memory (Style Reference):\n"
-            for entry in tm:
-                prompt += f"Source: {entry['src']}\nTarget: {entry['tgt']}\n"
-            prompt += "\n"
+    def translate(self, segment: str, terms: List[Dict], tm: List[Dict]) -> str:
+        prompt = self.construct_prompt(segment, terms, tm)
+        return self._reply_text(prompt)
 
-        prompt += "Translated Chinese Text:"
-        return prompt
+    def translate_batch(self, items: List[Dict]) -> List[str]:
+        """
+        批量翻译：一次请求翻译全部段落，解析失败时逐段重试
+        items 中每项需包含 masked_seg / terms / tm
+        """
+        if not items:
+            return []
+        if len(items) == 1:
+            item = items[0]
+            return [self.translate(item["masked_seg"], item["terms"], item["tm"])]
+
+        # 合并各段的参考信息并去重，保持首次出现的顺序
+        terms = list({t["term"]: t for item in items for t in item["terms"]}.values())
+        tm = list({entry["src"]: entry for item in items for entry in item["tm"]}.values())
+
+        prompt = self.construct_batch_prompt([item["masked_seg"] for item in items], terms, tm)
+        results = self.parse_batch_reply(self._reply_text(prompt), len(items))
+        if results is not None:
+            return results
+        return [self.translate(item["masked_seg"], item["terms"], item["tm"]) for item in items]
+
+    def close(self):
+        if self.llm_cache is not None:
+            self.llm_cache.close()
+            self.llm_cache = None
+            self.agent.client_cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _reply_text(self, prompt: str) -> str:
+        key = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+        cached = self._reply_cache.get(key)
+        if cached is not None:
+            self._reply_cache.move_to_end(key)
+            return cached
+
+        response = self.agent.generate_reply(messages=[{"content": prompt, "role": "user"}])
+        if isinstance(response, dict):
+            response = response.get("content")
+        if not response:
+            return ""
+
+        self._reply_cache[key] = response
+        if len(self._reply_cache) > self.cache_size:
+            self._reply_cache.popitem(last=False)
+        return response
 
 
 # --- 3. 模拟工作流组装逻辑 ---
 
 def run_translation_phase(config_list):
-    # 1. 初始化翻译引擎
-    engine = TranslationEngine({"config_list": config_list})
+    # 1. 初始化翻译引擎 (开启磁盘缓存，重跑时直接复用已有译文)
+    engine = TranslationEngine({"config_list": config_list}, cache_path=".autogen_cache")
 
     # 2. 获取之前步骤的模拟数据
     # 假设这是从前面的 Registry 中汇总的信息
@@ -75,30 +168,29 @@ def run_translation_phase(config_list):
     processed_data = [
         {
             "id": 0,
-            "masked_seg": "The [[MASK_VAR_A1B2]] workflow is deterministic.",
+            "masked_seg": "The [[M000000]] workflow is deterministic.",
             "terms": [{"term": "workflow", "translation": "工作流"},
                       {"term": "deterministic", "translation": "确定性"}],
             "tm": [{"src": "The workflow is highly deterministic.", "tgt": "该工作流具有高度确定性。"}]
+        },
+        {
+            "id": 1,
+            "masked_seg": "Contact [[M000001]] for workflow support.",
+            "terms": [{"term": "workflow", "translation": "工作流"}],
+            "tm": []
         }
     ]
 
-    translated_results = []
-
     print(">>> 开始执行确定性翻译...\n")
 
-    for item in processed_data:
-        # 组装 Prompt
-        final_prompt = engine.construct_prompt(
-            item["masked_seg"],
-            item["terms"],
-            item["tm"]
-        )
-
-        # 调用 Agent (此处会触发 LLM 调用)
-        # 实际上在 AutoGen 中，这里可以使用 client.create 或是 initiate_chat
-        # 为了演示逻辑，我们展示如何发送消息
-        response = engine.agent.generate_reply(messages=[{"content": final_prompt, "role": "user"}])
+    # 所有段落合并为一次 LLM 调用 (解析失败时自动回退为逐段调用)
+    try:
+        translations = engine.translate_batch(processed_data)
+    finally:
+        engine.close()
 
+    translated_results = []
+    for item, response in zip(processed_data, translations):
         translated_results.append({
             "id": item["id"],
             "original_masked": item["masked_seg"],
@@ -126,10 +218,10 @@ if __name__ == "__main__":
         # 打印一下组装出来的最终 Prompt 样式
         from Retriever.RetrieveAgent import storage
 
-        test_engine = TranslationEngine({"config_list": []})
-        sample_prompt = test_engine.construct_prompt(
-            "Use [[MASK_VAR_XYZ]] for AutoGen.",
-            [{"term": "AutoGen", "translation": "自动智能体框架"}],
-            []
-        )
+        with TranslationEngine({"config_list": []}) as test_engine:
+            sample_prompt = test_engine.construct_prompt(
+                "Use [[M000000]] for AutoGen.",
+                [{"term": "AutoGen", "translation": "自动智能体框架"}],
+                []
+            )
         print(sample_prompt)
\ No newline at end of file